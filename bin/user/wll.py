@@ -24,9 +24,19 @@ This driver fetches new data from the device and sends it to WeeWX.
 
 """
 
-from __future__ import with_statement
+import logging
 import time
 import requests
+from requests.adapters import HTTPAdapter
+
+# Use the fastest available JSON parser; all of them accept the raw response bytes.
+try:
+    from orjson import loads as _loads
+except ImportError:
+    try:
+        from ujson import loads as _loads
+    except ImportError:
+        from json import loads as _loads
 
 import weewx
 import weewx.drivers
@@ -36,38 +46,143 @@ DRIVER_VERSION = '0.1'
 
 MM_TO_INCH = 0.0393701
 
-try:
-    # WeeWX 4 logging
-    import weeutil.logger
-    import logging
+# Connect and read timeouts (in seconds) for requests to the device.
+HTTP_TIMEOUT = (3, 5)
 
-    log = logging.getLogger(__name__)
+# Rain collector size (in inches) indexed by the `rain_size` type code.
+_RAIN_SIZE = (None, 0.01, 0.2 * MM_TO_INCH, 0.1, 0.001 * MM_TO_INCH)
 
-    # def logdbg(msg):
-    #     log.debug(msg)
+# WLL condition fields copied as-is into WeeWX packet fields, per record type.
 
-    # def loginf(msg):
-    #     log.info(msg)
+# 1 = ISS Current Conditions record
+_ISS_FIELDS = (
+    ('temp', 'outTemp'),  # most recent valid temperature **(°F)**
+    ('hum', 'outHumidity'),  # most recent valid humidity **(%RH)**
+    ('dew_point', 'dewpoint'),  # **(°F)**
+    ('heat_index', 'heatindex'),  # **(°F)**
+    ('wind_chill', 'windchill'),  # **(°F)**
+    ('wind_speed_last', 'windSpeed'),  # most recent valid wind speed **(mph)**
+    ('wind_dir_last', 'windDir'),  # most recent valid wind direction **(°degree)**
+    ('wind_speed_hi_last_10_min', 'windGust'),  # maximum wind speed over last 10 min **(mph)**
+    ('wind_dir_scalar_avg_last_10_min', 'windGustDir'),  # gust wind direction over last 10 min **(°degree)**
+    ('solar_rad', 'radiation'),
+    ('uv_index', 'UV'),
+    ('trans_battery_flag', 'txBatteryStatus'),
+)
 
-    def logerr(msg):
-        log.error(msg)
+# 2 = Leaf/Soil Moisture Current Conditions record
+_SOIL_FIELDS = (
+    ('temp_1', 'soilTemp1'),  # most recent valid soil temp slot 1 **(°F)**
+    ('temp_2', 'soilTemp2'),  # most recent valid soil temp slot 2 **(°F)**
+    ('temp_3', 'soilTemp3'),  # most recent valid soil temp slot 3 **(°F)**
+    ('temp_4', 'soilTemp4'),  # most recent valid soil temp slot 4 **(°F)**
+    ('moist_soil_1', 'soilMoist1'),  # most recent valid soil moisture slot 1 **(|cb|)**
+    ('moist_soil_2', 'soilMoist2'),  # most recent valid soil moisture slot 2 **(|cb|)**
+    ('moist_soil_3', 'soilMoist3'),  # most recent valid soil moisture slot 3 **(|cb|)**
+    ('moist_soil_4', 'soilMoist4'),  # most recent valid soil moisture slot 4 **(|cb|)**
+    ('wet_leaf_1', 'leafWet1'),  # most recent valid leaf wetness slot 1 **(no unit)**
+    ('wet_leaf_2', 'leafWet2'),  # most recent valid leaf wetness slot 2 **(no unit)**
+)
 
-except ImportError:
-    # Old-style WeeWX logging
-    import syslog
+# 3 = LSS BAR Current Conditions record
+_BAR_FIELDS = (
+    ('bar_sea_level', 'barometer'),  # most recent bar sensor reading with elevation adjustment **(inches)**
+    ('bar_absolute', 'pressure'),  # raw bar sensor reading **(inches)**
+)
+
+# 4 = LSS Temp/Hum Current Conditions record
+_THI_FIELDS = (
+    ('temp_in', 'inTemp'),  # most recent valid inside temp **(°F)**
+    ('hum_in', 'inHumidity'),  # most recent valid inside humidity **(%RH)**
+    ('dew_point_in', 'inDewpoint'),  # **(°F)**
+)
+
+log = logging.getLogger(__name__)
+
+# def logdbg(msg):
+#     log.debug(msg)
+
+# def loginf(msg):
+#     log.info(msg)
+
+
+def logerr(msg):
+    log.error(msg)
+
+
+def _copy_fields(condition, packet, fields):
+    for src, dst in fields:
+        value = condition.get(src)
+        if value is not None:
+            packet[dst] = value
+
+
+def _handle_iss(condition, packet, driver):
+
+    _copy_fields(condition, packet, _ISS_FIELDS)
+
+    lsid = condition.get("lsid")
+    rain_count_size = driver._rain_count_size.get(lsid)
+
+    if rain_count_size is None:
+
+        rain_collector_type = condition.get("rain_size")  # rain collector type/size **(0: Reserved, 1: 0.01", 2: 0.2 mm, 3:  0.1 mm, 4: 0.001")**
+
+        if rain_collector_type is not None and 1 <= rain_collector_type <= 4:
+            rain_count_size = _RAIN_SIZE[rain_collector_type]
+            driver._rain_count_size[lsid] = rain_count_size
+
+    if rain_count_size is None:
+        return
+
+    rain_rate_last = condition.get("rain_rate_last")  # most recent valid rain rate **(counts/hour)**
 
+    if rain_rate_last is not None:
+        packet['rainRate'] = rain_rate_last * rain_count_size
 
-    def logmsg(level, msg):
-        syslog.syslog(level, 'WLL: %s' % msg)
+    rain_storm = condition.get("rain_storm")  # total rain count since last 24 hour long break in rain **(counts)**
+    rain_storm_start_at = condition.get("rain_storm_start_at")  # UNIX timestamp of current rain storm start **(seconds)**
 
-    # def logdbg(msg):
-    #     logmsg(syslog.LOG_DEBUG, msg)
+    rain_count = 0.0
 
-    # def loginf(msg):
-    #     logmsg(syslog.LOG_INFO, msg)
+    # Both are null while no rain storm is active, in which case no rain has accumulated.
+    if rain_storm is not None and rain_storm_start_at is not None:
 
-    def logerr(msg):
-        logmsg(syslog.LOG_ERR, msg)
+        # Calculate the rain accumulation by reading the total rain count and checking the increments
+
+        if driver.last_rain_storm is not None and driver.last_rain_storm_start_at is not None:
+
+            if rain_storm_start_at != driver.last_rain_storm_start_at:
+                rain_count = rain_storm
+
+            elif rain_storm >= driver.last_rain_storm:
+                rain_count = rain_storm - driver.last_rain_storm
+
+        driver.last_rain_storm = rain_storm
+        driver.last_rain_storm_start_at = rain_storm_start_at
+
+    packet['rain'] = rain_count * rain_count_size
+
+
+def _handle_soil(condition, packet, driver):
+    _copy_fields(condition, packet, _SOIL_FIELDS)
+
+
+def _handle_bar(condition, packet, driver):
+    _copy_fields(condition, packet, _BAR_FIELDS)
+
+
+def _handle_thi(condition, packet, driver):
+    _copy_fields(condition, packet, _THI_FIELDS)
+
+
+# Condition record handlers, by `data_structure_type`.
+_HANDLERS = {
+    1: _handle_iss,  # ISS Current Conditions record
+    2: _handle_soil,  # Leaf/Soil Moisture Current Conditions record
+    3: _handle_bar,  # LSS BAR Current Conditions record
+    4: _handle_thi,  # LSS Temp/Hum Current Conditions record
+}
 
 
 def loader(config_dict, engine):
@@ -110,193 +225,82 @@ class WLL(weewx.drivers.AbstractDevice):
 
         self.hardware = stn_dict.get('hardware')
 
+        # Keep the connection to the device alive between polls.
+        self._session = requests.Session()
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._session.headers.update({'Connection': 'keep-alive'})
+
         self.last_rain_storm = None
         self.last_rain_storm_start_at = None
 
+        # Rain collector size per transmitter (keyed by `lsid`), cached after the first observation.
+        self._rain_count_size = {}
+
+        self._packet_base = {'usUnits': weewx.US}
+
     def hardware_name(self):
         return self.hardware
 
     def genLoopPackets(self):
 
+        # WeeWX pulls loop packets synchronously from its engine thread, so
+        # blocking on the request and the sleep between polls is expected here.
+        monotonic = time.monotonic
+        sleep = time.sleep
+
         while True:
 
+            start_time = monotonic()
+
             try:
 
                 try:
 
-                    response = requests.get(self.service_url)
+                    response = self._session.get(self.service_url, timeout=HTTP_TIMEOUT)
 
                 except Exception as exception:
 
                     logerr("Error connecting to the WeatherLink Live device.")
                     logerr("%s" % exception)
 
-                    time.sleep(2)
+                    sleep(2)
 
                     continue  # Continue without exiting.
 
-                data = response.json()
-
-                timestamp = data['data']['ts']
-
-                _packet = {
-                    'dateTime': timestamp,
-                    'usUnits': weewx.US
-                }
-
-                for condition in data['data']['conditions']:
+                # The response is a few KB at most, so parsing the whole document
+                # in one go is cheaper than streaming it.
+                payload = _loads(response.content)
 
-                    data_structure_type = condition["data_structure_type"]
+                data = payload['data']
 
-                    # 1 = ISS Current Conditions record
-                    if data_structure_type == 1:
+                _packet = self._packet_base.copy()
+                _packet['dateTime'] = data['ts']
 
-                        if "temp" in condition:  # most recent valid temperature **(°F)**
-                            _packet.update({'outTemp': condition["temp"]})
+                for condition in data['conditions']:
 
-                        if "hum" in condition:  # most recent valid temperature **(°F)**
-                            _packet.update({'outHumidity': condition["hum"]})
+                    try:
 
-                        if "dew_point" in condition:  # **(°F)**
-                            _packet.update({'dewpoint': condition["dew_point"]})
+                        handler = _HANDLERS.get(condition["data_structure_type"])
 
-                        if "heat_index" in condition:  # **(°F)**
-                            _packet.update({'heatindex': condition["heat_index"]})
+                        if handler is not None:
+                            handler(condition, _packet, self)
 
-                        if "wind_chill" in condition:  # **(°F)**
-                            _packet.update({'windchill': condition["wind_chill"]})
+                    except Exception as exception:
 
-                        if "wind_speed_last" in condition:  # most recent valid wind speed **(mph)**
-                            _packet.update({'windSpeed': condition["wind_speed_last"]})
-
-                        if "wind_dir_last" in condition:  # most recent valid wind direction **(°degree)**
-                            _packet.update({'windDir': condition["wind_dir_last"]})
-
-                        if "wind_speed_hi_last_10_min" in condition:  # maximum wind speed over last 10 min **(mph)**
-                            _packet.update({'windGust': condition["wind_speed_hi_last_10_min"]})
-
-                        if "wind_dir_scalar_avg_last_10_min" in condition:  # gust wind direction over last 10 min **(°degree)**
-                            _packet.update({'windGustDir': condition["wind_dir_scalar_avg_last_10_min"]})
-
-                        if "rain_size" in condition:  # rain collector type/size **(0: Reserved, 1: 0.01", 2: 0.2 mm, 3:  0.1 mm, 4: 0.001")**
-
-                            rain_collector_type = condition["rain_size"]
-
-                            if 1 <= rain_collector_type <= 4:
-
-                                if rain_collector_type == 1:
-                                    rain_count_size = 0.01
-
-                                elif rain_collector_type == 2:
-                                    rain_count_size = 0.2 * MM_TO_INCH
-
-                                elif rain_collector_type == 3:
-                                    rain_count_size = 0.1
-
-                                elif rain_collector_type == 4:
-                                    rain_count_size = 0.001 * MM_TO_INCH
-
-                                if "rain_rate_last" in condition:  # most recent valid rain rate **(counts/hour)**
-                                    _packet.update({'rainRate': float(condition["rain_rate_last"]) * rain_count_size})
-
-                                if "rain_storm" in condition and "rain_storm_start_at" in condition:
-
-                                    # Calculate the rain accumulation by reading the total rain count and checking the increments
-
-                                    rain_storm = condition["rain_storm"]  # total rain count since last 24 hour long break in rain **(counts)**
-                                    rain_storm_start_at = condition["rain_storm_start_at"]  # UNIX timestamp of current rain storm start **(seconds)**
-
-                                    rain_count = 0.0
-
-                                    if self.last_rain_storm is not None and self.last_rain_storm_start_at is not None:
-
-                                        if rain_storm_start_at != self.last_rain_storm_start_at:
-                                            rain_count = rain_storm
-
-                                        elif rain_storm >= self.last_rain_storm:
-                                            rain_count = float(rain_storm) - float(self.last_rain_storm)
-
-                                    self.last_rain_storm = rain_storm
-                                    self.last_rain_storm_start_at = rain_storm_start_at
-
-                                    _packet.update({'rain': rain_count * rain_count_size})
-
-                        if "solar_rad" in condition:  #
-                            _packet.update({'radiation': condition["solar_rad"]})
-
-                        if "uv_index" in condition:  #
-                            _packet.update({'UV': condition["uv_index"]})
-
-                        if "trans_battery_flag" in condition:  #
-                            _packet.update({'txBatteryStatus': condition["trans_battery_flag"]})
-
-                    # 2 = Leaf/Soil Moisture Current Conditions record
-                    elif data_structure_type == 2:
-
-                        if "temp_1" in condition:  # most recent valid soil temp slot 1 **(°F)**
-                            _packet.update({'soilTemp1': condition["temp_1"]})
-
-                        if "temp_2" in condition:  # most recent valid soil temp slot 2 **(°F)**
-                            _packet.update({'soilTemp2': condition["temp_2"]})
-
-                        if "temp_3" in condition:  # most recent valid soil temp slot 3 **(°F)**
-                            _packet.update({'soilTemp3': condition["temp_3"]})
-
-                        if "temp_4" in condition:  # most recent valid soil temp slot 4 **(°F)**
-                            _packet.update({'soilTemp4': condition["temp_4"]})
-
-                        if "moist_soil_1" in condition:  # most recent valid soil moisture slot 1 **(|cb|)**
-                            _packet.update({'soilMoist1': condition["moist_soil_1"]})
-
-                        if "moist_soil_2" in condition:  # most recent valid soil moisture slot 2 **(|cb|)**
-                            _packet.update({'soilMoist3': condition["moist_soil_2"]})
-
-                        if "moist_soil_3" in condition:  # most recent valid soil moisture slot 3 **(|cb|)**
-                            _packet.update({'soilMoist3': condition["moist_soil_3"]})
-
-                        if "moist_soil_4" in condition:  # most recent valid soil moisture slot 4 **(|cb|)**
-                            _packet.update({'soilMoist4': condition["moist_soil_4"]})
-
-                        if "wet_leaf_1" in condition:  # most recent valid leaf wetness slot 1 **(no unit)**
-                            _packet.update({'leafWet1': condition["wet_leaf_1"]})
-
-                        if "wet_leaf_2" in condition:  # most recent valid leaf wetness slot 2 **(no unit)**
-                            _packet.update({'leafWet2': condition["wet_leaf_2"]})
-
-                    # 3 = LSS BAR Current Conditions record
-                    elif data_structure_type == 3:
-
-                        if "bar_sea_level" in condition:  # most recent bar sensor reading with elevation adjustment **(inches)**
-                            _packet.update({'barometer': condition["bar_sea_level"]})
-
-                        if "bar_absolute" in condition:  # raw bar sensor reading **(inches)**
-                            _packet.update({'pressure': condition["bar_absolute"]})
-
-                    # 4 = LSS Temp/Hum Current Conditions record
-                    elif data_structure_type == 4:
-
-                        if "temp_in" in condition:  # most recent valid inside temp **(°F)**
-                            _packet.update({'inTemp': condition["temp_in"]})
-
-                        if "hum_in" in condition:  # most recent valid inside humidity **(%RH)**
-                            _packet.update({'inHumidity': condition["hum_in"]})
-
-                        if "dew_point_in" in condition:  # **(°F)**
-                            _packet.update({'inDewpoint': condition["dew_point_in"]})
+                        logerr("Error parsing a WeatherLink Live condition record.")
+                        logerr("%s" % exception)
 
                 yield _packet
 
-                time.sleep(self.poll_interval)
-
             except Exception as exception:
 
                 logerr("Error parsing the WeatherLink Live json data.")
                 logerr("%s" % exception)
 
-                time.sleep(self.poll_interval)
-
                 pass  # Continue without exiting.
 
+            # Subtract the time spent fetching and parsing so polls keep a steady cadence.
+            sleep_for = self.poll_interval - (monotonic() - start_time)
+            if sleep_for > 0:
+                sleep(sleep_for)
 
-wll = WLL()
-wll.genLoopPackets()